@@ -1,22 +1,38 @@
-import os
+import re
+import time
+import numpy as np
 import pandas as pd
 import streamlit as st
-from datetime import datetime
-from supabase import create_client
+from collections import deque
+from datetime import datetime, timezone
+from supabase import Client, create_client
 
 # ------------------------------------------
 # Conexión a supabase
 # ------------------------------------------
 SUPABASE_URL = st.secrets["SUPABASE_URL"]
 SUPABASE_KEY = st.secrets["SUPABASE_KEY"]
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+@st.cache_resource
+def get_supabase() -> Client:
+    """Crea el cliente una sola vez y lo reutiliza entre reruns (mantiene el pool de conexiones)."""
+    return create_client(SUPABASE_URL, SUPABASE_KEY)
+
+supabase = get_supabase()
 
 TABLE_NAME = "confiteria_duicino"
+# Columnas que usa la UI (evita select("*"))
+PRODUCT_COLUMNS = "id_product,nombre,precio,categorias,en_venta,ts"
+# Máximo de filas por petición en inserciones masivas
+INSERT_BATCH_LIMIT = 100
+# Ventana (segundos) para ignorar envíos repetidos del mismo producto
+DUPLICATE_WINDOW_S = 5
 
 # Categorías permitidas
 ALLOWED_CATEGORIES = [
     "Chocolates", "Caramelos", "Mashmelos", "Galletas", "Salados", "Gomas de mascar"
 ]
+ALLOWED_CATEGORIES_SET = frozenset(ALLOWED_CATEGORIES)
 
 # ------------------------------------------
 # Utilidades
@@ -42,62 +58,87 @@ def validar(nombre: str, precio: float, categorias: list[str]) -> str | None:
         return "El precio debe ser mayor a 0 y menor a 999"
     if not categorias:
         return "Debe elegir al menos una categoría"
-    for c in categorias:
-        if c not in ALLOWED_CATEGORIES:
-            return f"Categoría inválida: {c}"
+    invalidas = set(categorias) - ALLOWED_CATEGORIES_SET
+    if invalidas:
+        return f"Categoría inválida: {', '.join(sorted(invalidas))}"
     return None
 
 # ------------------------------------------
 # Funciones CRUD
 # ------------------------------------------
-def format_time_ago(timestamp_str):
-    """Convierte timestamp a formato relativo legible"""
-    try:
-        from datetime import datetime, timezone
-        now = datetime.now(timezone.utc)
-        ts = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
-        
-        diff = now - ts
-        
-        if diff.days > 0:
-            if diff.days == 1:
-                return "Ayer"
-            elif diff.days < 7:
-                return f"Hace {diff.days} días"
-            else:
-                return ts.strftime('%d/%m/%Y')
-        elif diff.seconds >= 3600:
-            hours = diff.seconds // 3600
-            if hours == 1:
-                return "Hace 1 hora"
-            else:
-                return f"Hace {hours} horas"
-        elif diff.seconds >= 60:
-            minutes = diff.seconds // 60
-            if minutes == 1:
-                return "Hace 1 minuto"
-            else:
-                return f"Hace {minutes} minutos"
-        else:
-            return "Ahora mismo"
-    except:
-        return timestamp_str
-
-def sb_list() -> pd.DataFrame:
+def format_time_ago(ts_col: pd.Series) -> pd.Series:
+    """Convierte una columna de timestamps a formato relativo legible (vectorizado)"""
+    ts = pd.to_datetime(ts_col, utc=True, errors="coerce", format="ISO8601")
+    diff = pd.Timestamp.now(tz="UTC") - ts
+    days = diff.dt.days
+    hours = diff.dt.seconds // 3600
+    minutes = diff.dt.seconds // 60
+
+    conditions = [
+        ts.isna(),
+        days == 1,
+        (days > 1) & (days < 7),
+        days >= 7,
+        hours == 1,
+        hours > 1,
+        minutes == 1,
+        minutes > 1,
+    ]
+    choices = [
+        ts_col,
+        "Ayer",
+        "Hace " + days.astype("Int64").astype(str) + " días",
+        ts.dt.strftime('%d/%m/%Y'),
+        "Hace 1 hora",
+        "Hace " + hours.astype("Int64").astype(str) + " horas",
+        "Hace 1 minuto",
+        "Hace " + minutes.astype("Int64").astype(str) + " minutos",
+    ]
+    return pd.Series(np.select(conditions, choices, default="Ahora mismo"), index=ts_col.index)
+
+def sb_apply_filters(query, search: str, categorias: list[str]):
+    """Aplica en el servidor los filtros por nombre y por categorías."""
+    if search:
+        query = query.ilike("nombre", f"%{search}%")
+    if categorias:
+        # 'categorias' se guarda como 'A;B;C': coincidencia exacta de alguna, anclada a los
+        # separadores y tolerante a espacios (como categorias_to_list), sin aceptar 'Chocolatess'
+        opciones = "|".join(re.escape(c) for c in categorias)
+        query = query.filter("categorias", "match", f"(^|;)[[:space:]]*({opciones})[[:space:]]*(;|$)")
+    return query
+
+@st.cache_data(ttl="30s", max_entries=8)
+def sb_count(search: str, categorias: list[str]) -> int:
+    res = sb_apply_filters(
+        supabase.table(TABLE_NAME).select("id_product", count="exact", head=True),
+        search, categorias,
+    ).execute()
+    return res.count or 0
+
+@st.cache_data(ttl="30s", max_entries=8)
+def sb_page(offset: int, limit: int, search: str, categorias: list[str]) -> pd.DataFrame:
     res = (
-        supabase.table(TABLE_NAME)
-        .select("id_product,nombre,precio,categorias,en_venta,ts")
+        sb_apply_filters(
+            supabase.table(TABLE_NAME).select(PRODUCT_COLUMNS),
+            search, categorias,
+        )
+        # id_product desempata filas con el mismo ts para que la paginación sea estable
         .order("ts", desc=True)
+        .order("id_product", desc=True)
+        .range(offset, offset + limit - 1)
         .execute()
     )
-    df = pd.DataFrame(res.data or [])
-    
+    # Con columnas fijas, una página vacía conserva su estructura
+    df = pd.DataFrame(res.data or [], columns=PRODUCT_COLUMNS.split(","))
+
     # Convertir timestamp a formato legible
-    if not df.empty and 'ts' in df.columns:
-        df['registrado'] = df['ts'].apply(format_time_ago)
-        df = df.drop(columns=['ts'])
-    
-    return df
+    df['registrado'] = format_time_ago(df['ts'])
+    return df.drop(columns=['ts'])
+
+def sb_clear_cache():
+    """Invalida las lecturas cacheadas tras cualquier escritura."""
+    sb_count.clear()
+    sb_page.clear()
 
 def sb_insert(nombre: str, precio: float, categorias: list, en_venta: bool):
     payload = {
@@ -105,9 +146,31 @@ def sb_insert(nombre: str, precio: float, categorias: list, en_venta: bool):
         "precio": precio,
         "categorias": categorias_to_string(categorias),
         "en_venta": en_venta,
-        "ts": datetime.utcnow().isoformat()
     }
-    supabase.table(TABLE_NAME).insert(payload).execute()
+    sb_insert_many([payload])
+
+def sb_insert_many(rows: list[dict]):
+    """Inserta varias filas en lotes de INSERT_BATCH_LIMIT (una petición por lote).
+
+    Cada fila lleva nombre, precio, categorias (lista o 'A;B') y en_venta; si falta
+    'ts' se usa la hora actual en UTC.
+    """
+    if not rows:
+        return
+    ts = datetime.now(timezone.utc).isoformat()
+    payloads = []
+    for row in rows:
+        payload = dict(row)
+        if isinstance(payload.get("categorias"), (list, tuple)):
+            payload["categorias"] = categorias_to_string(payload["categorias"])
+        payload.setdefault("ts", ts)
+        payloads.append(payload)
+    try:
+        for i in range(0, len(payloads), INSERT_BATCH_LIMIT):
+            supabase.table(TABLE_NAME).insert(payloads[i:i + INSERT_BATCH_LIMIT]).execute()
+    finally:
+        # Aunque falle un lote, los anteriores ya se guardaron
+        sb_clear_cache()
 
 def sb_update(id_: int, nombre: str, precio: float, categorias: list, en_venta: bool):
     payload = {
@@ -117,9 +180,11 @@ def sb_update(id_: int, nombre: str, precio: float, categorias: list, en_venta:
         "en_venta": en_venta,
     }
     supabase.table(TABLE_NAME).update(payload).eq("id_product", id_).execute()
+    sb_clear_cache()
 
 def sb_delete(id_: int):
     supabase.table(TABLE_NAME).delete().eq("id_product", id_).execute()
+    sb_clear_cache()
 
 #------------------------------------- UI -----------------------------------
 st.title("Confitería Dulcino - Registro de productos")
@@ -142,9 +207,18 @@ if submitted:
             st.error("Lo sentimos no pudo crear este producto")
         st.info(err)
     else:
-        sb_insert(nombre.strip(), float(precio), categorias, en_venta)
-        st.success("Felicidades su producto se agregó")
-        st.rerun()
+        # Evita duplicados por doble envío: solo se ignora el mismo registro
+        # si se aceptó hace menos de DUPLICATE_WINDOW_S segundos
+        recent = st.session_state.setdefault("recent_inserts", deque(maxlen=5))
+        key = (nombre.strip(), float(precio), tuple(sorted(categorias)), en_venta)
+        now = time.monotonic()
+        if any(k == key and now - t < DUPLICATE_WINDOW_S for k, t in recent):
+            st.warning("Este producto ya se registró.")
+        else:
+            sb_insert(nombre.strip(), float(precio), categorias, en_venta)
+            recent.append((key, now))
+            st.success("Felicidades su producto se agregó")
+            st.rerun()
 
 st.divider()
 
@@ -183,132 +257,121 @@ def clear_filters():
 
 st.sidebar.button("🧹 Limpiar filtros", type="secondary", on_click=clear_filters)
 
-# --- Cargar data ---
-df = sb_list()
-
-# Preprocesar una columna lista para filtrar por categorías
-df["categorias_list"] = df["categorias"].apply(categorias_to_list)
+# --- Listado: se ejecuta como fragmento para que paginar/editar no recargue toda la app ---
+@st.fragment
+def product_list_view(items_per_page: int, search_term: str, category_filter: list[str]):
+    # --- Contar resultados (filtros aplicados en Supabase) ---
+    total_items = sb_count(search_term, category_filter)
 
-# --- Aplicar filtros ---
-if search_term:
-    df = df[df["nombre"].str.contains(search_term, case=False, na=False)]
-
-if category_filter:
-    df = df[df["categorias_list"].apply(lambda lst: any(cat in lst for cat in category_filter))]
-
-# --- Mostrar resultados o vacío ---
-if df.empty:
-    if search_term or category_filter:
-        st.info("No se encontraron productos con los filtros aplicados. Intenta con otros criterios de búsqueda.")
-    else:
-        st.info("No hay productos aún.")
-else:
-    # --- Paginación ---
-    total_items = len(df)
-    total_pages = (total_items + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE
-
-    col1, col2, col3 = st.columns([1, 2, 1])
-    with col1:
-        current_page = st.selectbox(
-            "Página",
-            options=list(range(1, total_pages + 1)) if total_pages > 0 else [1],
-            index=0,
-            key="current_page",
-            format_func=lambda x: f"Página {x} de {total_pages}" if total_pages > 0 else "Página 1 de 1",
-        )
-    with col2:
+    # --- Mostrar resultados o vacío ---
+    if total_items == 0:
         if search_term or category_filter:
-            st.write(f"**{total_items} productos encontrados** (filtros aplicados)")
+            st.info("No se encontraron productos con los filtros aplicados. Intenta con otros criterios de búsqueda.")
         else:
-            st.write(f"**{total_items} productos**")
-    with col3:
-        if total_pages > 1:
-            st.write(f"**{ITEMS_PER_PAGE} por página**")
-
-    start_idx = (current_page - 1) * ITEMS_PER_PAGE
-    end_idx = min(start_idx + ITEMS_PER_PAGE, total_items)
-    df_page = df.iloc[start_idx:end_idx].copy()
-
-    # Mostrar tabla paginada (con campos bonitos)
-    df_page_view = df_page.drop(columns=["categorias_list"])
-    
-    # Renombrar columnas para mejor visualización
-    df_page_view = df_page_view.rename(columns={
-        'id_product': 'ID',
-        'nombre': 'Producto',
-        'precio': 'Precio (S/)',
-        'categorias': 'Categorías',
-        'en_venta': 'En Venta',
-        'registrado': 'Registrado'
-    })
-    
-    # Formatear precio y en_venta
-    df_page_view['Precio (S/)'] = df_page_view['Precio (S/)'].apply(lambda x: f"S/ {x:.2f}")
-    df_page_view['En Venta'] = df_page_view['En Venta'].apply(lambda x: "✅ Sí" if x else "❌ No")
-    
-    st.dataframe(df_page_view, use_container_width=True)
-    if total_pages > 1:
-        st.caption(f"Mostrando productos {start_idx + 1} a {end_idx} de {total_items}")
-
-    # Validar que exista id_product
-    if "id_product" not in df.columns:
-        st.error(
-            "No se encontró la columna 'id_product' en los datos. "
-            f"Verifique la estructura de la tabla '{TABLE_NAME}' y las políticas RLS en Supabase."
-        )
+            st.info("No hay productos aún.")
     else:
+        # --- Paginación ---
+        total_pages = (total_items + items_per_page - 1) // items_per_page
+
+        col1, col2, col3 = st.columns([1, 2, 1])
+        with col1:
+            current_page = st.selectbox(
+                "Página",
+                options=list(range(1, total_pages + 1)) if total_pages > 0 else [1],
+                index=0,
+                key="current_page",
+                format_func=lambda x: f"Página {x} de {total_pages}" if total_pages > 0 else "Página 1 de 1",
+            )
+        with col2:
+            if search_term or category_filter:
+                st.write(f"**{total_items} productos encontrados** (filtros aplicados)")
+            else:
+                st.write(f"**{total_items} productos**")
+        with col3:
+            if total_pages > 1:
+                st.write(f"**{items_per_page} por página**")
+
+        start_idx = (current_page - 1) * items_per_page
+        # Solo se trae la página actual desde Supabase
+        df_page = sb_page(start_idx, items_per_page, search_term, category_filter)
+        end_idx = start_idx + len(df_page)
+        if df_page.empty:
+            # El conteo y la página se cachean por separado y pueden desfasarse
+            st.info("No hay productos en esta página con los filtros actuales.")
+            return
+
+        # Mostrar tabla paginada (con campos bonitos)
+        # Renombrar columnas para mejor visualización
+        df_page_view = df_page.rename(columns={
+            'id_product': 'ID',
+            'nombre': 'Producto',
+            'precio': 'Precio (S/)',
+            'categorias': 'Categorías',
+            'en_venta': 'En Venta',
+            'registrado': 'Registrado'
+        })
+
+        # Formatear precio y en_venta
+        df_page_view['Precio (S/)'] = np.char.mod("S/ %.2f", df_page_view['Precio (S/)'].to_numpy(dtype=float))
+        df_page_view['En Venta'] = np.where(df_page_view['En Venta'].astype(bool), "✅ Sí", "❌ No")
+
+        st.dataframe(df_page_view, use_container_width=True, hide_index=True)
+        if total_pages > 1:
+            st.caption(f"Mostrando productos {start_idx + 1} a {end_idx} de {total_items}")
+
         # Selector del producto (solo de la página actual)
-        opciones = {
-            f"{r['id_product']} | {r['nombre']} (S/{r['precio']})": r["id_product"]
-            for _, r in df_page.iterrows()
-        }
-
-        if opciones:
-            etiqueta = st.selectbox("Selecciona para editar/eliminar", list(opciones.keys()))
-            producto_id = int(opciones[etiqueta])
-            fila = df[df["id_product"] == producto_id].iloc[0]
-
-            with st.form("form-edit"):
-                c1, c2 = st.columns([2, 1])
-                with c1:
-                    ed_nombre = st.text_input("Nombre", value=fila["nombre"])
-                with c2:
-                    ed_precio = st.number_input(
-                        "precio (S/)", value=float(fila["precio"]),
-                        min_value=0.0, max_value=998.99, step=0.10, format="%.2f"
-                    )
-
-                # Default SOLO con categorías válidas para evitar errores por typos en BD
-                default_cats = [c for c in categorias_to_list(fila["categorias"]) if c in ALLOWED_CATEGORIES]
-                ed_categorias = st.multiselect("Categorías", ALLOWED_CATEGORIES, default=default_cats)
-                ed_en_venta = st.radio(
-                    "¿En venta?", ["Sí", "No"],
-                    index=0 if fila["en_venta"] else 1,
-                    horizontal=True
-                ) == "Sí"
-
-                colu1, colu2 = st.columns(2)
-                with colu1:
-                    btn_update = st.form_submit_button("Guardar Cambios")
-                with colu2:
-                    btn_delete = st.form_submit_button("Eliminar", type="primary")
-
-                if btn_update:
-                    err = validar(ed_nombre, ed_precio, ed_categorias)
-                    if err:
-                        if "precio" in err.lower():
-                            st.error("Por favor verifique el campo precio.")
-                        else:
-                            st.error("Lo sentimos no pudo actualizar este producto.")
-                        st.info(err)
+        rows_by_id = {r["id_product"]: r for r in df_page.to_dict("records")}
+        labels = (
+            df_page["id_product"].astype(str) + " | " + df_page["nombre"].astype(str)
+            + " (S/" + df_page["precio"].astype(str) + ")"
+        )
+        opciones = dict(zip(labels.tolist(), df_page["id_product"].tolist()))
+
+        etiqueta = st.selectbox("Selecciona para editar/eliminar", list(opciones.keys()))
+        producto_id = int(opciones[etiqueta])
+        fila = rows_by_id[producto_id]
+
+        with st.form("form-edit"):
+            c1, c2 = st.columns([2, 1])
+            with c1:
+                ed_nombre = st.text_input("Nombre", value=fila["nombre"])
+            with c2:
+                ed_precio = st.number_input(
+                    "precio (S/)", value=float(fila["precio"]),
+                    min_value=0.0, max_value=998.99, step=0.10, format="%.2f"
+                )
+
+            # Default SOLO con categorías válidas para evitar errores por typos en BD
+            default_cats = [c for c in categorias_to_list(fila["categorias"]) if c in ALLOWED_CATEGORIES_SET]
+            ed_categorias = st.multiselect("Categorías", ALLOWED_CATEGORIES, default=default_cats)
+            ed_en_venta = st.radio(
+                "¿En venta?", ["Sí", "No"],
+                index=0 if fila["en_venta"] else 1,
+                horizontal=True
+            ) == "Sí"
+
+            colu1, colu2 = st.columns(2)
+            with colu1:
+                btn_update = st.form_submit_button("Guardar Cambios")
+            with colu2:
+                btn_delete = st.form_submit_button("Eliminar", type="primary")
+
+            if btn_update:
+                err = validar(ed_nombre, ed_precio, ed_categorias)
+                if err:
+                    if "precio" in err.lower():
+                        st.error("Por favor verifique el campo precio.")
                     else:
-                        sb_update(producto_id, ed_nombre.strip(), float(ed_precio), ed_categorias, ed_en_venta)
-                        st.success("Producto Actualizado.")
-                        st.rerun()
-
-                if btn_delete:
-                    sb_delete(producto_id)
-                    st.success("Producto Eliminado")
-                    st.rerun()
-        else:
-            st.info("No hay productos en esta página con los filtros actuales.")
+                        st.error("Lo sentimos no pudo actualizar este producto.")
+                    st.info(err)
+                else:
+                    sb_update(producto_id, ed_nombre.strip(), float(ed_precio), ed_categorias, ed_en_venta)
+                    st.success("Producto Actualizado.")
+                    st.rerun(scope="fragment")
+
+            if btn_delete:
+                sb_delete(producto_id)
+                st.success("Producto Eliminado")
+                st.rerun(scope="fragment")
+
+product_list_view(ITEMS_PER_PAGE, search_term, category_filter)